@@ -1,7 +1,11 @@
+import functools
 from typing import Callable
 from typing import Dict
+from typing import List
 from typing import NamedTuple
 from typing import Optional
+from typing import Tuple
+from typing import Union
 
 import numpy as np
 
@@ -15,11 +19,23 @@ from optuna.samplers._tpe.probability_distributions import _BatchedDiscreteTrunc
 from optuna.samplers._tpe.probability_distributions import _BatchedDistributions
 from optuna.samplers._tpe.probability_distributions import _BatchedTruncNormDistributions
 from optuna.samplers._tpe.probability_distributions import _MixtureOfProductDistribution
+from optuna.samplers._tpe.probability_distributions import _round_to_step
 
 
 EPS = 1e-12
 
 
+def default_weights(x: int) -> np.ndarray:
+    if x == 0:
+        return np.asarray([])
+    elif x < 25:
+        return np.ones(x)
+    else:
+        ramp = np.linspace(1.0 / x, 1.0, num=x - 25)
+        flat = np.ones(25)
+        return np.concatenate([ramp, flat], axis=0)
+
+
 class _ParzenEstimatorParameters(
     NamedTuple(
         "_ParzenEstimatorParameters",
@@ -55,32 +71,34 @@ class _ParzenEstimator:
                 raise ValueError("Prior weight must be positive.")
 
         self._search_space = search_space
+        self._log_params = [param for param, dist in search_space.items() if self._is_log(dist)]
+        # The type dispatch of `_untransform` is resolved once here, as a list of
+        # (param_name, is_log, int_distribution_or_None).
+        self._untransform_ops: List[Tuple[str, bool, Optional[IntDistribution]]] = [
+            (param, self._is_log(dist), dist if isinstance(dist, IntDistribution) else None)
+            for param, dist in search_space.items()
+        ]
 
         transformed_observations = self._transform(observations)
+        n_observations = next(iter(transformed_observations.values()), np.empty(0)).size
 
-        assert predetermined_weights is None or len(transformed_observations) == len(
-            predetermined_weights
-        )
-        weights = (
-            predetermined_weights
-            if predetermined_weights is not None
-            else self._call_weights_func(parameters.weights, len(transformed_observations))
-        )
-
-        if len(transformed_observations) == 0:
-            weights = np.array([1.0])
-        elif parameters.consider_prior:
-            assert parameters.prior_weight is not None
-            weights = np.append(weights, [parameters.prior_weight])
-        weights /= weights.sum()
+        assert predetermined_weights is None or n_observations == len(predetermined_weights)
+        if predetermined_weights is not None:
+            weights = self._calculate_mixture_weights(
+                predetermined_weights, parameters.consider_prior, parameters.prior_weight
+            )
+        else:
+            weights = _calculate_mixture_weights_with_cache(
+                parameters.weights,
+                n_observations,
+                parameters.consider_prior,
+                parameters.prior_weight,
+            )
         self._mixture_distribution = _MixtureOfProductDistribution(
             weights=weights,
-            distributions=[
-                self._calculate_distributions(
-                    transformed_observations[:, i], param, search_space[param], parameters
-                )
-                for i, param in enumerate(search_space)
-            ],
+            distributions=self._calculate_distributions(
+                transformed_observations, n_observations, parameters
+            ),
         )
 
     def sample(self, rng: np.random.RandomState, size: int) -> Dict[str, np.ndarray]:
@@ -88,8 +106,14 @@ class _ParzenEstimator:
         return self._untransform(sampled)
 
     def log_pdf(self, samples_dict: Dict[str, np.ndarray]) -> np.ndarray:
+        # The samples may have an arbitrary shape, e.g. (n_batches, n_samples), in which case all
+        # of them are evaluated with a single flattened call.
         transformed_samples = self._transform(samples_dict)
-        return self._mixture_distribution.log_pdf(transformed_samples)
+        shape = next(iter(transformed_samples.values())).shape
+        log_pdfs = self._mixture_distribution.log_pdf(
+            [np.ravel(transformed_samples[param]) for param in self._search_space]
+        )
+        return log_pdfs.reshape(shape)
 
     @staticmethod
     def _call_weights_func(weights_func: Callable[[int], np.ndarray], n: int) -> np.ndarray:
@@ -114,69 +138,94 @@ class _ParzenEstimator:
         # unexpected size.
         return w
 
+    @staticmethod
+    def _calculate_mixture_weights(
+        weights: np.ndarray, consider_prior: bool, prior_weight: Optional[float]
+    ) -> np.ndarray:
+        if len(weights) == 0:
+            return np.array([1.0])
+        elif consider_prior:
+            assert prior_weight is not None
+            weights = np.append(weights, [prior_weight])
+        return weights / weights.sum()
+
     @staticmethod
     def _is_log(dist: BaseDistribution) -> bool:
         return isinstance(dist, (FloatDistribution, IntDistribution)) and dist.log
 
-    def _transform(self, samples_dict: Dict[str, np.ndarray]) -> np.ndarray:
-        return np.array(
-            [
-                np.log(samples_dict[param])
-                if self._is_log(self._search_space[param])
-                else samples_dict[param]
-                for param in self._search_space
-            ]
-        ).T
+    def _transform(self, samples_dict: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        transformed = {param: samples_dict[param] for param in self._search_space}
+        if len(self._log_params) > 0:
+            # The logarithm of all the log-scaled parameters is taken in a single call.
+            log_samples = np.log(
+                np.array([samples_dict[param] for param in self._log_params], dtype=float)
+            )
+            transformed.update(zip(self._log_params, log_samples))
+        return transformed
 
     def _untransform(self, samples_array: np.ndarray) -> Dict[str, np.ndarray]:
-        res = {
-            param: np.exp(samples_array[:, i])
-            if self._is_log(self._search_space[param])
-            else samples_array[:, i]
-            for i, param in enumerate(self._search_space)
-        }
-        # TODO(contramundum53): Remove this line after fixing log-Int hack.
-        return {
-            param: np.clip(
-                dist.low + np.round((res[param] - dist.low) / dist.step) * dist.step,
-                dist.low,
-                dist.high,
-            )
-            if isinstance(dist, IntDistribution)
-            else res[param]
-            for (param, dist) in self._search_space.items()
-        }
+        res = {}
+        for i, (param, is_log, int_distribution) in enumerate(self._untransform_ops):
+            samples = np.exp(samples_array[:, i]) if is_log else samples_array[:, i]
+            # TODO(contramundum53): Remove this line after fixing log-Int hack.
+            if int_distribution is not None:
+                samples = _round_to_step(
+                    samples,
+                    int_distribution.low,
+                    int_distribution.high,
+                    int_distribution.step,
+                    # The result of `np.exp` is a fresh array and can be overwritten.
+                    out=samples if is_log else None,
+                )
+            res[param] = samples
+        return res
 
     def _calculate_distributions(
         self,
-        transformed_observations: np.ndarray,
-        param_name: str,
-        search_space: BaseDistribution,
+        transformed_observations: Dict[str, np.ndarray],
+        n_observations: int,
         parameters: _ParzenEstimatorParameters,
-    ) -> _BatchedDistributions:
-        if isinstance(search_space, CategoricalDistribution):
-            return self._calculate_categorical_distributions(
-                transformed_observations, param_name, search_space, parameters
-            )
-        else:
+    ) -> List[_BatchedDistributions]:
+        distributions: Dict[str, _BatchedDistributions] = {}
+
+        numerical_params = []
+        numerical_bounds: List[_NumericalBounds] = []
+        for param, search_space in self._search_space.items():
+            if isinstance(search_space, CategoricalDistribution):
+                distributions[param] = self._calculate_categorical_distributions(
+                    transformed_observations[param], param, search_space, parameters
+                )
+                continue
+
             assert isinstance(search_space, (FloatDistribution, IntDistribution))
-            if search_space.log:
-                low = np.log(search_space.low)
-                high = np.log(search_space.high)
-            else:
-                low = search_space.low
-                high = search_space.high
-            step = search_space.step
-
-            # TODO(contramundum53): This is a hack and should be fixed.
-            if step is not None and search_space.log:
-                low = np.log(search_space.low - step / 2)
-                high = np.log(search_space.high + step / 2)
-                step = None
-
-            return self._calculate_numerical_distributions(
-                transformed_observations, low, high, step, parameters
+            numerical_params.append(param)
+            numerical_bounds.append(_get_numerical_bounds(search_space))
+
+        if len(numerical_params) > 0:
+            # All the numerical parameters are processed at once as rows of 2D arrays. The
+            # observations are written straight into the buffer that becomes the kernel centers.
+            consider_prior = parameters.consider_prior or n_observations == 0
+            mus = np.empty((len(numerical_params), n_observations + consider_prior), dtype=float)
+            for j, param in enumerate(numerical_params):
+                mus[j, :n_observations] = transformed_observations[param]
+            low, high, step_or_0, prior_mu, width = np.array(
+                [(b.low, b.high, b.step or 0, b.prior_mu, b.width) for b in numerical_bounds],
+                dtype=float,
+            ).T
+            sigmas = self._calculate_numerical_distributions(
+                mus, n_observations, low, high, step_or_0, prior_mu, width, parameters
             )
+            for j, (param, b) in enumerate(zip(numerical_params, numerical_bounds)):
+                if b.step is None:
+                    distributions[param] = _BatchedTruncNormDistributions(
+                        mus[j], sigmas[j], b.low, b.high
+                    )
+                else:
+                    distributions[param] = _BatchedDiscreteTruncNormDistributions(
+                        mus[j], sigmas[j], b.low, b.high, b.step
+                    )
+
+        return [distributions[param] for param in self._search_space]
 
     def _calculate_categorical_distributions(
         self,
@@ -188,98 +237,186 @@ class _ParzenEstimator:
         consider_prior = parameters.consider_prior or len(observations) == 0
 
         assert parameters.prior_weight is not None
-        weights = np.full(
-            shape=(len(observations) + consider_prior, len(search_space.choices)),
-            fill_value=parameters.prior_weight / (len(observations) + consider_prior),
-        )
+        n_choices = len(search_space.choices)
+        prior_value = parameters.prior_weight / (len(observations) + consider_prior)
 
         if param_name in parameters.categorical_distance_func:
+            weights = np.full(
+                shape=(len(observations) + consider_prior, n_choices), fill_value=prior_value
+            )
             dist_func = parameters.categorical_distance_func[param_name]
             for i, observation in enumerate(observations.astype(int)):
                 dists = [
                     dist_func(search_space.choices[observation], search_space.choices[j])
-                    for j in range(len(search_space.choices))
+                    for j in range(n_choices)
                 ]
                 exponent = -(
                     (np.array(dists) / max(dists)) ** 2
                     * np.log((len(observations) + consider_prior) / parameters.prior_weight)
-                    * (np.log(len(search_space.choices)) / np.log(6))
+                    * (np.log(n_choices) / np.log(6))
                 )
                 weights[i] = np.exp(exponent)
+            weights /= weights.sum(axis=1, keepdims=True)
         else:
-            weights[np.arange(len(observations)), observations.astype(int)] += 1
-        weights /= weights.sum(axis=1, keepdims=True)
+            # Every row of an observation sums up to `1 + n_choices * prior_value` and the prior
+            # row is uniform, so the weights are written already normalized.
+            normalizer = 1.0 + n_choices * prior_value
+            weights = np.full(
+                shape=(len(observations) + consider_prior, n_choices),
+                fill_value=prior_value / normalizer,
+            )
+            weights[np.arange(len(observations)), observations.astype(int)] += 1.0 / normalizer
+            if consider_prior:
+                weights[-1] = 1.0 / n_choices
         return _BatchedCategoricalDistributions(weights)
 
     def _calculate_numerical_distributions(
         self,
-        observations: np.ndarray,
-        low: float,
-        high: float,
-        step: Optional[float],
+        mus: np.ndarray,
+        n_observations: int,
+        low: np.ndarray,
+        high: np.ndarray,
+        step_or_0: np.ndarray,
+        prior_mu: np.ndarray,
+        width: np.ndarray,
         parameters: _ParzenEstimatorParameters,
-    ) -> _BatchedDistributions:
-        step_or_0 = step or 0
-
-        mus = observations
-        consider_prior = parameters.consider_prior or len(observations) == 0
-
-        def compute_sigmas() -> np.ndarray:
-            if parameters.multivariate:
-                SIGMA0_MAGNITUDE = 0.2
-                sigma = (
-                    SIGMA0_MAGNITUDE
-                    * max(len(observations), 1) ** (-1.0 / (len(self._search_space) + 4))
-                    * (high - low + step_or_0)
-                )
-                sigmas = np.full(shape=(len(observations),), fill_value=sigma)
-            else:
-                # TODO(contramundum53): Remove dependency on prior_mu
-                prior_mu = 0.5 * (low + high)
-                mus_with_prior = np.append(mus, prior_mu) if consider_prior else mus
-
-                sorted_indices = np.argsort(mus_with_prior)
-                sorted_mus = mus_with_prior[sorted_indices]
-                sorted_mus_with_endpoints = np.empty(len(mus_with_prior) + 2, dtype=float)
-                sorted_mus_with_endpoints[0] = low - step_or_0 / 2
-                sorted_mus_with_endpoints[1:-1] = sorted_mus
-                sorted_mus_with_endpoints[-1] = high + step_or_0 / 2
-
-                sorted_sigmas = np.maximum(
-                    sorted_mus_with_endpoints[1:-1] - sorted_mus_with_endpoints[0:-2],
-                    sorted_mus_with_endpoints[2:] - sorted_mus_with_endpoints[1:-1],
-                )
-
-                if not parameters.consider_endpoints and sorted_mus_with_endpoints.shape[0] >= 4:
-                    sorted_sigmas[0] = sorted_mus_with_endpoints[2] - sorted_mus_with_endpoints[1]
-                    sorted_sigmas[-1] = (
-                        sorted_mus_with_endpoints[-2] - sorted_mus_with_endpoints[-3]
-                    )
-
-                sigmas = sorted_sigmas[np.argsort(sorted_indices)][: len(observations)]
-
-            # We adjust the range of the 'sigmas' according to the 'consider_magic_clip' flag.
-            maxsigma = 1.0 * (high - low + step_or_0)
-            if parameters.consider_magic_clip:
-                # TODO(contramundum53): Remove dependency of minsigma on consider_prior.
-                minsigma = (
-                    1.0
-                    * (high - low + step_or_0)
-                    / min(100.0, (1.0 + len(observations) + consider_prior))
-                )
-            else:
-                minsigma = EPS
-            return np.asarray(np.clip(sigmas, minsigma, maxsigma))
+    ) -> np.ndarray:
+        # `mus` has the shape of (n_params, n_observations + consider_prior) and holds the
+        # observations in its first `n_observations` columns. The prior column is filled in place.
+        # `low`, `high`, `step_or_0`, `prior_mu` and `width` have the shape of (n_params,). The
+        # returned `sigmas` has the same shape as `mus`.
+        consider_prior = parameters.consider_prior or n_observations == 0
+
+        # We adjust the range of the 'sigmas' according to the 'consider_magic_clip' flag.
+        maxsigma = width
+        minsigma: Union[float, np.ndarray]
+        if parameters.consider_magic_clip:
+            # TODO(contramundum53): Remove dependency of minsigma on consider_prior.
+            minsigma = width / min(100.0, (1.0 + n_observations + consider_prior))
+        else:
+            minsigma = EPS
 
-        sigmas = compute_sigmas()
+        if consider_prior:
+            mus[:, -1] = prior_mu
+
+        if parameters.multivariate:
+            # The bandwidth does not depend on the observations, so it is computed and clipped
+            # once per parameter and then shared by all the kernels of that parameter.
+            SIGMA0_MAGNITUDE = 0.2
+            bandwidth_factor = SIGMA0_MAGNITUDE * max(n_observations, 1) ** (
+                -1.0 / (len(self._search_space) + 4)
+            )
+            sigma = np.clip(bandwidth_factor * width, minsigma, maxsigma)
+            sigmas = np.empty_like(mus)
+            sigmas[:, :n_observations] = sigma[:, None]
+        else:
+            # TODO(contramundum53): Remove dependency on prior_mu
+            sigmas = _calculate_univariate_sigmas(
+                mus, low, high, step_or_0, parameters.consider_endpoints
+            )
+            # The bounds of shape (n_params,) or scalars are broadcast against the transposed view.
+            clipped = sigmas[:, :n_observations].T
+            np.clip(clipped, minsigma, maxsigma, out=clipped)
 
         if consider_prior:
-            prior_mu = 0.5 * (low + high)
-            prior_sigma = 1.0 * (high - low + step_or_0)
-            mus = np.append(mus, [prior_mu])
-            sigmas = np.append(sigmas, [prior_sigma])
+            sigmas[:, -1] = width
+        return sigmas
+
+
+class _NumericalBounds(NamedTuple):
+    low: float
+    high: float
+    step: Optional[float]
+    prior_mu: float
+    width: float  # `high - low + step`, which is also the prior sigma and the maximum sigma.
+
+
+# The bounds only depend on the distribution, which does not change during a study.
+@functools.lru_cache(maxsize=1024)
+def _get_numerical_bounds(
+    search_space: Union[FloatDistribution, IntDistribution],
+) -> _NumericalBounds:
+    if search_space.log:
+        low = np.log(search_space.low)
+        high = np.log(search_space.high)
+    else:
+        low = search_space.low
+        high = search_space.high
+    step = search_space.step
+
+    # TODO(contramundum53): This is a hack and should be fixed.
+    if step is not None and search_space.log:
+        low = np.log(search_space.low - step / 2)
+        high = np.log(search_space.high + step / 2)
+        step = None
+
+    return _NumericalBounds(
+        low=low,
+        high=high,
+        step=step,
+        prior_mu=0.5 * (low + high),
+        width=high - low + (step or 0),
+    )
 
-        if step is None:
-            return _BatchedTruncNormDistributions(mus, sigmas, low, high)
-        else:
-            return _BatchedDiscreteTruncNormDistributions(mus, sigmas, low, high, step)
+
+def _calculate_mixture_weights_with_cache(
+    weights_func: Callable[[int], np.ndarray],
+    n: int,
+    consider_prior: bool,
+    prior_weight: Optional[float],
+) -> np.ndarray:
+    # User-supplied weights functions may be stateful, so only the default one is memoized.
+    if weights_func is not default_weights:
+        return _ParzenEstimator._calculate_mixture_weights(
+            _ParzenEstimator._call_weights_func(weights_func, n), consider_prior, prior_weight
+        )
+    return _calculate_default_mixture_weights(n, consider_prior, prior_weight)
+
+
+# TPE constructs estimators with the same number of observations over and over again, so the
+# validated and normalized default weights are memoized. The returned arrays are read-only as
+# they are shared.
+@functools.lru_cache(maxsize=1024)
+def _calculate_default_mixture_weights(
+    n: int, consider_prior: bool, prior_weight: Optional[float]
+) -> np.ndarray:
+    weights = _ParzenEstimator._calculate_mixture_weights(
+        _ParzenEstimator._call_weights_func(default_weights, n), consider_prior, prior_weight
+    )
+    weights.setflags(write=False)
+    return weights
+
+
+def _calculate_univariate_sigmas(
+    mus: np.ndarray,
+    low: np.ndarray,
+    high: np.ndarray,
+    step_or_0: np.ndarray,
+    consider_endpoints: bool,
+) -> np.ndarray:
+    # All the parameters are processed at once, with `mus` of shape (n_params, n_kernels) and the
+    # others of shape (n_params,). Each row has at least one kernel since the prior is included
+    # when there are no observations.
+    sorted_indices = np.argsort(mus, axis=1)
+    sorted_mus = np.take_along_axis(mus, sorted_indices, axis=1)
+
+    # Each gap is shared by two neighboring kernels, so we compute it only once. The gaps to the
+    # endpoints are filled in directly instead of copying `sorted_mus` into a padded buffer.
+    gaps = np.empty((mus.shape[0], mus.shape[1] + 1), dtype=float)
+    gaps[:, 0] = sorted_mus[:, 0] - (low - step_or_0 / 2)
+    np.subtract(sorted_mus[:, 1:], sorted_mus[:, :-1], out=gaps[:, 1:-1])
+    gaps[:, -1] = (high + step_or_0 / 2) - sorted_mus[:, -1]
+    # `sorted_mus` is no longer needed, so its buffer is reused.
+    sorted_sigmas = np.maximum(gaps[:, :-1], gaps[:, 1:], out=sorted_mus)
+
+    if not consider_endpoints and mus.shape[1] >= 2:
+        sorted_sigmas[:, 0] = gaps[:, 1]
+        sorted_sigmas[:, -1] = gaps[:, -2]
+
+    # Scattering back through the permutation is O(n), unlike inverting it with another argsort.
+    # Ranking with `np.searchsorted` is not an option: it is one-dimensional, and tied kernels,
+    # which are common for discrete parameters, would all be mapped to the first of their sorted
+    # positions instead of sharing the sigmas of all of them.
+    sigmas = np.empty_like(sorted_sigmas)
+    np.put_along_axis(sigmas, sorted_indices, sorted_sigmas, axis=1)
+    return sigmas
@@ -1,5 +1,7 @@
 from typing import List
 from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
 from typing import Union
 
 import numpy as np
@@ -26,6 +28,19 @@ class _BatchedDiscreteTruncNormDistributions(NamedTuple):
     step: float
 
 
+def _round_to_step(
+    x: np.ndarray, low: float, high: float, step: float, out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    # Computes `clip(low + round((x - low) / step) * step, low, high)` in a single buffer
+    # instead of allocating a temporary array for every operation.
+    out = np.subtract(x, low, out=out, dtype=np.float64)
+    np.divide(out, step, out=out)
+    np.round(out, out=out)
+    np.multiply(out, step, out=out)
+    np.add(out, low, out=out)
+    return np.clip(out, low, high, out=out)
+
+
 _BatchedDistributions = Union[
     _BatchedCategoricalDistributions,
     _BatchedTruncNormDistributions,
@@ -69,27 +84,33 @@ class _MixtureOfProductDistribution(NamedTuple):
                     scale=active_sigmas,
                     random_state=rng,
                 )
-                ret[:, i] = np.clip(
-                    d.low + np.round((samples - d.low) / d.step) * d.step, d.low, d.high
-                )
+                ret[:, i] = _round_to_step(samples, d.low, d.high, d.step, out=samples)
             else:
                 assert False
 
         return ret
 
-    def log_pdf(self, x: np.ndarray) -> np.ndarray:
-        batch_size, n_vars = x.shape
-        log_pdfs = np.empty((batch_size, len(self.weights), n_vars), dtype=np.float64)
-        for i, d in enumerate(self.distributions):
-            xi = x[:, i]
+    def log_pdf(self, x: Union[np.ndarray, Sequence[np.ndarray]]) -> np.ndarray:
+        # `x` is either an array of shape (batch_size, n_vars) or a sequence of n_vars arrays of
+        # shape (batch_size,), which lets callers pass per-variable arrays without stacking them.
+        if isinstance(x, np.ndarray):
+            batch_size = x.shape[0]
+            columns: Sequence[np.ndarray] = list(x.T)
+        else:
+            batch_size = len(x[0])
+            columns = x
+        # The log-densities of the product distributions are accumulated per component, so that
+        # only a (batch_size, n_components) array is needed regardless of the number of variables.
+        weighted_log_pdf = np.zeros((batch_size, len(self.weights)), dtype=np.float64)
+        for d, xi in zip(self.distributions, columns):
             if isinstance(d, _BatchedCategoricalDistributions):
-                log_pdfs[:, :, i] = np.log(
+                weighted_log_pdf += np.log(
                     np.take_along_axis(
                         d.weights[None, :, :], xi[:, None, None].astype(np.int64), axis=-1
                     )
                 )[:, :, 0]
             elif isinstance(d, _BatchedTruncNormDistributions):
-                log_pdfs[:, :, i] = _truncnorm.logpdf(
+                weighted_log_pdf += _truncnorm.logpdf(
                     x=xi[:, None],
                     a=(d.low - d.mu[None, :]) / d.sigma[None, :],
                     b=(d.high - d.mu[None, :]) / d.sigma[None, :],
@@ -109,11 +130,12 @@ class _MixtureOfProductDistribution(NamedTuple):
                     (d.low - d.step / 2 - d.mu[None, :]) / d.sigma[None, :],
                     (d.high + d.step / 2 - d.mu[None, :]) / d.sigma[None, :],
                 )
-                log_pdfs[:, :, i] = log_gauss_mass - log_p_accept
+                weighted_log_pdf += log_gauss_mass - log_p_accept
 
             else:
                 assert False
-        weighted_log_pdf = np.sum(log_pdfs, axis=-1) + np.log(self.weights[None, :])
+        weighted_log_pdf += np.log(self.weights[None, :])
+        # The mixture is evaluated with the log-sum-exp trick.
         max_ = weighted_log_pdf.max(axis=1)
         # We need to avoid (-inf) - (-inf) when the probability is zero.
         max_[np.isneginf(max_)] = 0
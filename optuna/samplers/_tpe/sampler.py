@@ -25,6 +25,7 @@ from optuna.samplers._lazy_random_state import LazyRandomState
 from optuna.samplers._random import RandomSampler
 from optuna.samplers._tpe.parzen_estimator import _ParzenEstimator
 from optuna.samplers._tpe.parzen_estimator import _ParzenEstimatorParameters
+from optuna.samplers._tpe.parzen_estimator import default_weights as default_weights
 from optuna.search_space import IntersectionSearchSpace
 from optuna.search_space.group_decomposed import _GroupDecomposedSearchSpace
 from optuna.search_space.group_decomposed import _SearchSpaceGroup
@@ -46,17 +47,6 @@ def hyperopt_default_gamma(x: int) -> int:
     return min(int(np.ceil(0.25 * np.sqrt(x))), 25)
 
 
-def default_weights(x: int) -> np.ndarray:
-    if x == 0:
-        return np.asarray([])
-    elif x < 25:
-        return np.ones(x)
-    else:
-        ramp = np.linspace(1.0 / x, 1.0, num=x - 25)
-        flat = np.ones(25)
-        return np.concatenate([ramp, flat], axis=0)
-
-
 class TPESampler(BaseSampler):
     """Sampler using TPE (Tree-structured Parzen Estimator) algorithm.
 
@@ -381,3 +381,119 @@ def test_invalid_weights(weights: Callable[[int], np.ndarray]) -> None:
         _ParzenEstimator(
             {"a": np.asarray([0.0])}, {"a": distributions.FloatDistribution(-1.0, 1.0)}, parameters
         )
+
+
+def test_stateful_weights_func_is_not_cached() -> None:
+    class DecayingWeights:
+        def __init__(self) -> None:
+            self.decay = 1.0
+
+        def __call__(self, x: int) -> np.ndarray:
+            return self.decay ** np.arange(x)[::-1]
+
+    weights = DecayingWeights()
+    parameters = _ParzenEstimatorParameters(
+        prior_weight=1.0,
+        consider_prior=False,
+        consider_magic_clip=False,
+        consider_endpoints=False,
+        weights=weights,
+        multivariate=False,
+        categorical_distance_func={},
+    )
+    observations = {"a": np.asarray([-0.4, 0.0, 0.4])}
+    search_space: Dict[str, distributions.BaseDistribution] = {
+        "a": distributions.FloatDistribution(-1.0, 1.0)
+    }
+
+    mpe = _ParzenEstimator(observations, search_space, parameters)
+    np.testing.assert_almost_equal(mpe._mixture_distribution.weights, [1.0 / 3] * 3)
+
+    weights.decay = 0.5
+    mpe = _ParzenEstimator(observations, search_space, parameters)
+    np.testing.assert_almost_equal(mpe._mixture_distribution.weights, [1.0 / 7, 2.0 / 7, 4.0 / 7])
+
+
+@pytest.mark.parametrize("prior_weight", [0.5, 1.0, 2.0])
+def test_default_mixture_weights(prior_weight: float) -> None:
+    parameters = _ParzenEstimatorParameters(
+        prior_weight=prior_weight,
+        consider_prior=True,
+        consider_magic_clip=False,
+        consider_endpoints=False,
+        weights=default_weights,
+        multivariate=False,
+        categorical_distance_func={},
+    )
+    observations = {"a": np.linspace(-0.5, 0.5, 30)}
+    search_space: Dict[str, distributions.BaseDistribution] = {
+        "a": distributions.FloatDistribution(-1.0, 1.0)
+    }
+    expected = np.append(default_weights(30), prior_weight)
+    expected /= expected.sum()
+    for _ in range(2):
+        mpe = _ParzenEstimator(observations, search_space, parameters)
+        np.testing.assert_almost_equal(mpe._mixture_distribution.weights, expected)
+
+
+def test_predetermined_weights_are_not_modified() -> None:
+    parameters = _ParzenEstimatorParameters(
+        prior_weight=1.0,
+        consider_prior=False,
+        consider_magic_clip=False,
+        consider_endpoints=False,
+        weights=default_weights,
+        multivariate=False,
+        categorical_distance_func={},
+    )
+    predetermined_weights = np.asarray([1.0, 3.0])
+    mpe = _ParzenEstimator(
+        {"a": np.asarray([-0.4, 0.4])},
+        {"a": distributions.FloatDistribution(-1.0, 1.0)},
+        parameters,
+        predetermined_weights,
+    )
+    np.testing.assert_almost_equal(mpe._mixture_distribution.weights, [0.25, 0.75])
+    np.testing.assert_equal(predetermined_weights, [1.0, 3.0])
+
+
+@pytest.mark.parametrize("multivariate", [True, False])
+def test_log_pdf_batched_samples(multivariate: bool) -> None:
+    parameters = _ParzenEstimatorParameters(
+        consider_prior=True,
+        prior_weight=1.0,
+        consider_magic_clip=True,
+        consider_endpoints=False,
+        weights=default_weights,
+        multivariate=multivariate,
+        categorical_distance_func={},
+    )
+    mpe = _ParzenEstimator(MULTIVARIATE_SAMPLES, SEARCH_SPACE, parameters)
+    samples = [mpe.sample(np.random.RandomState(seed), 5) for seed in range(3)]
+    batched_samples = {param: np.stack([s[param] for s in samples]) for param in SEARCH_SPACE}
+
+    log_pdfs = mpe.log_pdf(batched_samples)
+    assert log_pdfs.shape == (3, 5)
+    for i, s in enumerate(samples):
+        np.testing.assert_almost_equal(log_pdfs[i], mpe.log_pdf(s))
+
+
+def test_calculate_with_tied_observations() -> None:
+    parameters = _ParzenEstimatorParameters(
+        prior_weight=1.0,
+        consider_prior=False,
+        consider_magic_clip=False,
+        consider_endpoints=True,
+        weights=default_weights,
+        multivariate=False,
+        categorical_distance_func={},
+    )
+    mpe = _ParzenEstimator(
+        {"a": np.asarray([0.0, 0.0, 0.0])},
+        {"a": distributions.FloatDistribution(-1.0, 1.0)},
+        parameters,
+    )
+    distribution = mpe._mixture_distribution.distributions[0]
+    assert isinstance(distribution, _BatchedTruncNormDistributions)
+    # Each tied kernel takes one of the sigmas of the sorted positions.
+    np.testing.assert_almost_equal(np.sort(distribution.sigma), [0.0, 1.0, 1.0])
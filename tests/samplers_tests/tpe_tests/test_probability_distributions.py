@@ -56,6 +56,15 @@ def test_mixture_of_product_distribution() -> None:
     log_pdf = mixture_distribution.log_pdf(samples)
     assert log_pdf.shape == (5,)
 
+    # Test that per-variable arrays give the same result as a stacked array.
+    np.testing.assert_equal(mixture_distribution.log_pdf(list(samples.T)), log_pdf)
+
+    # Test that a mixture without variables has zero log-density.
+    empty_mixture_distribution = _MixtureOfProductDistribution(
+        weights=np.array([0.5, 0.5]), distributions=[]
+    )
+    np.testing.assert_equal(empty_mixture_distribution.log_pdf(np.empty((3, 0))), np.zeros(3))
+
 
 def test_mixture_of_product_distribution_extreme_case() -> None:
     rng = np.random.RandomState(0)